@@ -1,66 +1,21 @@
 import streamlit as st
 import pandas as pd
-import io
-from datetime import datetime, timedelta
+import numpy as np
+from datetime import date, timedelta
 import calendar
 import json
 import os
 
-# --- 関数定義 ---
-def load_and_prepare_data(data_file_path):
-    """CSVデータを読み込み、ファイル名と共にDataFrameを返す"""
-    try:
-        with open(data_file_path, 'r', encoding='utf-8') as f:
-            csv_data = f.read()
-    except FileNotFoundError:
-        st.error(f"シフトデータファイル ({data_file_path}) が見つかりません。")
-        return None, data_file_path
-
-    df = pd.read_csv(io.StringIO(csv_data.strip()), header=None)
-    df.columns = ['週', 'イ', 'ロ', 'ハ', 'ニ', 'ホ', 'ヘ', 'ト']
-    df = df.set_index('週')
-    df = df.sort_index()
-    return df, data_file_path
+# --- 定数 ---
+CONFIG_FILE = "settings.json"
 
-def flatten_shift_data(shift_df):
-    """DataFrameのシフトデータを1次元のリストに変換する"""
-    if shift_df is None:
-        return []
-    group_list = ['イ', 'ロ', 'ハ', 'ニ', 'ホ', 'ヘ', 'ト']
-    flat_list = []
-    for week_num in sorted(shift_df.index):
-        for group in group_list:
-            flat_list.append(shift_df.loc[week_num, group])
-    return flat_list
-
-def get_daily_kinmu(target_date, ref_date, ref_shift_index, flat_shift_list):
-    """基準日と基準シフトからの日数差で、指定日の勤務、週、グループを計算して返す"""
-    if not flat_shift_list:
-        return "データなし", "-", "-"  # Return a tuple
-
-    group_list = ['イ', 'ロ', 'ハ', 'ニ', 'ホ', 'ヘ', 'ト']
-    day_difference = (target_date - ref_date).days
-    total_shifts = len(flat_shift_list)
-
-    # Calculate the target index in the flattened list (0-251)
-    target_index = (ref_shift_index + day_difference) % total_shifts
-
-    # From the target index, derive the week and group
-    shift_table_week = (target_index // len(group_list)) + 1
-    current_group_index = target_index % len(group_list)
-    current_group = group_list[current_group_index]
-
-    kinmu = flat_shift_list[target_index]
-
-    return kinmu, shift_table_week, current_group
-
-def create_calendar_html(year, month, get_kinmu_func):
-    """指定された月のカレンダーHTMLを、スタイル付きで動的に生成する"""
-    cal = calendar.Calendar(firstweekday=0)
-    
-    # HTMLの各部分をリストとして構築
-    html_parts = [
-        """
+# シフト表の担当グループ (列の並び順) と、グループ名から列番号への対応
+GROUP_LIST = ('イ', 'ロ', 'ハ', 'ニ', 'ホ', 'ヘ', 'ト')
+GROUP_INDEX = {group: i for i, group in enumerate(GROUP_LIST)}
+_GROUP_ARRAY = np.asarray(GROUP_LIST)
+
+# カレンダーのスタイルとヘッダー行 (create_calendar_html の呼び出しごとに組み立てないよう、スクリプトの実行ごとに一度だけ作る)
+_CALENDAR_STYLE = """
         <style>
         .month-table { border-collapse: collapse; width: 100%; }
         .month-table th { text-align: center; height: 40px; border: 1px solid #ddd; background-color: #f2f2f2; }
@@ -73,63 +28,22 @@ def create_calendar_html(year, month, get_kinmu_func):
         .weekend-day { background-color: #f0f8ff; } /* 土曜日の薄い背景色 */
         .sunday-day { background-color: #ffe0e6; } /* 日曜日の薄いピンク系背景色 */
         </style>
-        """,
-        '<table class="month-table">',
-        '<tr>'
-    ]
-    
-    headers = ["月", "火", "水", "木", "金", "土", "日"]
-    for day in headers:
-        html_parts.append(f"<th>{day}</th>")
-    html_parts.append('</tr>')
-
-    for week in cal.monthdatescalendar(year, month):
-        html_parts.append('<tr>')
-        for day_date in week:
-            td_class = []
-            if day_date.month != month:
-                td_class.append("other-month")
-            
-            if day_date.weekday() == 5: # 土曜日
-                td_class.append("weekend-day")
-            elif day_date.weekday() == 6: # 日曜日
-                td_class.append("sunday-day")
-            
-            class_attr = f' class="{' '.join(td_class)}"' if td_class else ''
-
-            if day_date.month != month:
-                html_parts.append(f'<td{class_attr}><span class="day-number">{day_date.day}</span></td>')
-            else:
-                kinmu, shift_week, shift_group = get_kinmu_func(day_date)
-                
-                color = "black" # デフォルトの色を黒に設定
-
-                if str(kinmu) == "公" or str(kinmu) == "休":
-                    color = "red"
-                elif "泊" in str(kinmu):
-                    color = "blue"
-                elif "明" in str(kinmu):
-                    color = "green"
-                
-                html_parts.append(f'<td{class_attr}><span class="day-number">{day_date.day}</span>')
-                html_parts.append(f'<span class="week-info">W{shift_week} {shift_group}</span>')
-                html_parts.append(f'<span class="kinmu" style="color:{color};">{kinmu}</span></td>')
-        html_parts.append('</tr>')
-        
-    html_parts.append("</table>")
-    return "".join(html_parts)
-
-# --- Streamlitアプリのメイン処理 ---
-st.set_page_config(page_title="交代番シフトカレンダー", layout="wide")
-
-col1, col2 = st.columns([0.7, 0.3]) # タイトルとサブヘッダーの幅を調整
-with col1:
-    st.title("交代番シフトカレンダー")
-with col2:
-    st.subheader("月間シフト")
+        """
+_CALENDAR_HEADERS = ["月", "火", "水", "木", "金", "土", "日"]
+# 曜日 (月=0 ... 日=6) ごとに付けるクラス名
+_WEEKDAY_CLS = ("", "", "", "", "", " weekend-day", " sunday-day")
+# 曜日ごとの <td> 開始タグ (当月の日付用と、前後の月の日付用)
+_IN_MONTH_TD = tuple(f'<td class="{cls.strip()}">' if cls else '<td>' for cls in _WEEKDAY_CLS)
+_OTHER_MONTH_TD = tuple(f'<td class="other-month{cls}">' for cls in _WEEKDAY_CLS)
+_CALENDAR_PREFIX = (
+    _CALENDAR_STYLE
+    + '<table class="month-table"><tr>'
+    + "".join(f"<th>{day}</th>" for day in _CALENDAR_HEADERS)
+    + '</tr>'
+)
 
-# グローバル印刷用CSS
-st.markdown("""
+# 印刷時にサイドバーを隠し、カレンダーを1ページに収めるためのCSS
+_PRINT_CSS = """
 <style>
 @media print {
     /* サイドバーを非表示にする */
@@ -184,42 +98,162 @@ st.markdown("""
     }
 }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# --- 関数定義 ---
+@st.cache_data(show_spinner=False)
+def _load_config(mtime):
+    """設定ファイルを読み込む (mtimeが変わるまで再読み込みしない)"""
+    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+@st.cache_data(ttl=5, show_spinner=False)
+def _list_csv():
+    """プログラムフォルダ内のCSVファイル名を、名前順のリストで返す (5秒間キャッシュ)"""
+    return sorted(f for f in os.listdir('.') if f.endswith('.csv'))
+
+@st.cache_data(show_spinner=False)
+def load_and_prepare_data(data_file_path, mtime):
+    """CSVデータを読み込み、ファイル名と共にDataFrameを返す (mtimeが変わるまでキャッシュ)"""
+    # ファイルが存在しない場合は、呼び出し側のmtime取得の時点で扱う
+    # ファイルのパスを直接渡して、pandasのCパーサーに読み込ませる
+    # 勤務の列はcategory型を指定して、型推論を省く
+    df = pd.read_csv(
+        data_file_path,
+        header=None,
+        names=['週', *GROUP_LIST],
+        index_col='週',
+        dtype={group: "category" for group in GROUP_LIST},
+        encoding='utf-8'
+    )
+    df = df.sort_index()
+    return df, data_file_path
+
+@st.cache_data(show_spinner=False)
+def flatten_shift_data(_shift_df, data_file_path, mtime):
+    """DataFrameのシフトデータを1次元のリストに変換する (CSVのパスとmtimeでキャッシュ)"""
+    if _shift_df is None:
+        return []
+    # 読み込み時に週番号でソート済みなので、グループの順に並べてそのまま1次元に展開する
+    return _shift_df[list(GROUP_LIST)].to_numpy().ravel().tolist()
+
+def classify_kinmu_color(kinmu):
+    """勤務の内容から、カレンダーに表示する文字色を決める"""
+    kinmu_str = str(kinmu)
+    if kinmu_str == "公" or kinmu_str == "休":
+        return "red"
+    elif "泊" in kinmu_str:
+        return "blue"
+    elif "明" in kinmu_str:
+        return "green"
+    return "black" # デフォルトの色を黒に設定
+
+@st.cache_data(show_spinner=False)
+def build_color_map(_shift_df, data_file_path, mtime):
+    """勤務の種類 (各列のカテゴリ) ごとに一度だけ色を判定し、{勤務: 色} の辞書を返す (CSVのパスとmtimeでキャッシュ)"""
+    if _shift_df is None:
+        return {}
+    kinmu_values = set()
+    for group in GROUP_LIST:
+        kinmu_values.update(_shift_df[group].cat.categories)
+    return {kinmu: classify_kinmu_color(kinmu) for kinmu in kinmu_values}
+
+def compute_shift_indices(base_ordinal, ref_ordinal, ref_shift_index, total_shifts, n_days):
+    """base_ordinal の日から n_days 日分について、シフト表上の位置・週番号・グループ番号を配列で返す"""
+    base = (ref_shift_index + base_ordinal - ref_ordinal) % total_shifts
+    target_indices = (base + np.arange(n_days, dtype=np.int64)) % total_shifts
+    shift_weeks = target_indices // len(GROUP_LIST) + 1
+    group_indices = target_indices % len(GROUP_LIST)
+    return target_indices, shift_weeks, group_indices
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def create_calendar_html(year, month, ref_ordinal, ref_shift_index, flat_shift_tuple, color_map):
+    """指定された月のカレンダーHTMLを、スタイル付きで動的に生成する (引数が同じならキャッシュを返す)"""
+    # HTMLの各部分をリストとして構築 (スタイルとヘッダー行は定数を使い回す)
+    html_parts = [_CALENDAR_PREFIX]
+
+    # 1日を含む週の月曜日から、月末を含む週の日曜日までの日付を直接計算する
+    first = date(year, month, 1)
+    start_date = first - timedelta(days=first.weekday())
+    n_weeks = (first.weekday() + calendar.monthrange(year, month)[1] + 6) // 7
+    n_cells = n_weeks * 7
+    days = [start_date + timedelta(days=i) for i in range(n_cells)]
+
+    # 表示する全セル分の勤務・週・グループをNumPyでまとめて取得する
+    if flat_shift_tuple:
+        flat_shift_arr = np.asarray(flat_shift_tuple, dtype=object)
+        total_shifts = len(flat_shift_arr)
+        indices, shift_weeks, group_indices = compute_shift_indices(
+            start_date.toordinal(), ref_ordinal, ref_shift_index, total_shifts, n_cells
+        )
+        kinmus = flat_shift_arr[indices]
+        groups = _GROUP_ARRAY[group_indices]
+    else:
+        kinmus = ["データなし"] * n_cells
+        shift_weeks = ["-"] * n_cells
+        groups = ["-"] * n_cells
+
+    for week_start in range(0, n_cells, 7):
+        row_cells = []
+        for cell in range(week_start, week_start + 7):
+            day_date = days[cell]
+            weekday = day_date.weekday()
+
+            if day_date.month != month:
+                # 前後の月の日付は日にちだけの固定の形なので、勤務の計算をせずにすぐ追加する
+                row_cells.append(f'{_OTHER_MONTH_TD[weekday]}<span class="day-number">{day_date.day}</span></td>')
+            else:
+                kinmu, shift_week, shift_group = kinmus[cell], shift_weeks[cell], groups[cell]
+                
+                color = color_map.get(kinmu, "black") # 未知の勤務はデフォルトの黒
+                
+                # セル1つ分のHTMLを1回のappendで追加する
+                row_cells.append(
+                    f'{_IN_MONTH_TD[weekday]}<span class="day-number">{day_date.day}</span>'
+                    f'<span class="week-info">W{shift_week} {shift_group}</span>'
+                    f'<span class="kinmu" style="color:{color};">{kinmu}</span></td>'
+                )
+        html_parts.append(f"<tr>{''.join(row_cells)}</tr>")
+        
+    html_parts.append("</table>")
+    return "".join(html_parts)
+
+# --- Streamlitアプリのメイン処理 ---
+st.set_page_config(page_title="交代番シフトカレンダー", layout="wide")
+
+col1, col2 = st.columns([0.7, 0.3]) # タイトルとサブヘッダーの幅を調整
+with col1:
+    st.title("交代番シフトカレンダー")
+with col2:
+    st.subheader("月間シフト")
+
+# グローバル印刷用CSS (再実行のたびに書き出さないとページから消えるため、出力自体は毎回行う)
+st.markdown(_PRINT_CSS, unsafe_allow_html=True)
 
 # --- 1. データと設定の準備 (サイドバーに配置) ---
 st.sidebar.header("個人設定")
 st.sidebar.info("カレンダー上の特定の日が、シフト表のどの勤務に対応するかを設定してください。")
 
-CONFIG_FILE = "settings.json"
-config = {}
-try:
-    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-        config = json.load(f)
-except FileNotFoundError:
-    pass
+config = _load_config(os.path.getmtime(CONFIG_FILE)) if os.path.exists(CONFIG_FILE) else {}
 
 ref_date_input = st.sidebar.date_input(
     "① 基準日",
-    value=datetime.strptime(config.get("ref_date", "2025-07-14"), "%Y-%m-%d"),
+    value=date.fromisoformat(config.get("ref_date", "2025-07-14")),
     format="YYYY-MM-DD"
 )
 ref_week_input = st.sidebar.number_input(
     "② 基準日の週番号 (1-36)",
     min_value=1, max_value=36, value=config.get("ref_week", 9)
 )
-group_list = ['イ', 'ロ', 'ハ', 'ニ', 'ホ', 'ヘ', 'ト']
-try:
-    default_group_index = group_list.index(config.get("ref_group", "ハ"))
-except ValueError:
-    default_group_index = 0
+default_group_index = GROUP_INDEX.get(config.get("ref_group", "ハ"), 0)
 ref_group_input = st.sidebar.selectbox(
     "③ 基準日の担当グループ",
-    group_list,
+    GROUP_LIST,
     index=default_group_index
 )
 
 # プログラムフォルダ内のCSVファイルを取得
-csv_files = [f for f in os.listdir('.') if f.endswith('.csv')]
+csv_files = _list_csv()
 if not csv_files:
     st.error("プログラムフォルダ内にCSVファイルが見つかりません。")
     st.stop()
@@ -234,7 +268,14 @@ selected_csv_file = st.sidebar.selectbox(
     index=csv_files.index(default_selected_csv)
 )
 
-shift_df, loaded_filename = load_and_prepare_data(selected_csv_file)
+try:
+    csv_mtime = os.path.getmtime(selected_csv_file)
+except OSError:
+    # 一覧のキャッシュ中にファイルが削除された場合など
+    st.error(f"シフトデータファイル ({selected_csv_file}) が見つかりません。")
+    shift_df, loaded_filename = None, selected_csv_file
+else:
+    shift_df, loaded_filename = load_and_prepare_data(selected_csv_file, csv_mtime)
 st.sidebar.markdown(
     f"""
     <div style="
@@ -266,7 +307,7 @@ if st.sidebar.button("この設定を保存"):
     st.sidebar.success("設定を保存しました！")
 
 # --- 2. 表示する年月を選択 ---
-current_date = datetime.now()
+current_date = date.today()
 col_year, col_month = st.columns(2)
 with col_year:
     target_year = st.number_input("年", min_value=2020, max_value=2050, value=current_date.year)
@@ -279,25 +320,32 @@ try:
     if shift_df is not None:
         # st.caption(f"データソース: {loaded_filename}") # この行は不要になる
 
-        flat_shift_list = flatten_shift_data(shift_df)
+        flat_shift_list = flatten_shift_data(shift_df, selected_csv_file, csv_mtime)
+        color_map = build_color_map(shift_df, selected_csv_file, csv_mtime)
         
+        # 週番号が重複していると行番号を1つに決められないため、先に確認する
+        if not shift_df.index.is_unique:
+            duplicated_weeks = shift_df.index[shift_df.index.duplicated()].unique().tolist()
+            st.error(f"エラー: CSVファイル ({loaded_filename}) に重複した週番号があります: {duplicated_weeks}")
+            st.stop()
+
         try:
-            week_row_index = sorted(shift_df.index).index(ref_week_input)
-        except ValueError:
+            # 読み込み時に週番号でソート済みなので、インデックス上の位置がそのまま行番号になる
+            week_row_index = shift_df.index.get_loc(ref_week_input)
+        except KeyError:
             st.error(f"エラー: 指定された週番号 {ref_week_input} はデータに存在しません。")
             st.stop()
             
-        group_col_index = group_list.index(ref_group_input)
-        ref_shift_index = week_row_index * len(group_list) + group_col_index
+        group_col_index = GROUP_INDEX[ref_group_input]
+        ref_shift_index = week_row_index * len(GROUP_LIST) + group_col_index
         
-        ref_date = ref_date_input
-
-        # ラッパー関数を作成して、get_daily_kinmuに必要な引数を渡す
-        def get_kinmu_for_calendar(target_date):
-            return get_daily_kinmu(target_date, ref_date, ref_shift_index, flat_shift_list)
+        ref_date = ref_date_input # st.date_input は date を返すので、そのまま日単位で使う
+        ref_ordinal = ref_date.toordinal()
 
-        # 新しい関数でHTMLを生成
-        calendar_html = create_calendar_html(target_year, target_month, get_kinmu_for_calendar)
+        # キャッシュのキーにするため、シフトリストはタプルに変換して渡す
+        calendar_html = create_calendar_html(
+            target_year, target_month, ref_ordinal, ref_shift_index, tuple(flat_shift_list), color_map
+        )
         
         st.markdown(calendar_html, unsafe_allow_html=True)
 